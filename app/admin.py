@@ -1,26 +1,62 @@
 from fastapi import APIRouter, Request, Depends, HTTPException
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from config import config
+from .config import get_secret
+from redis.exceptions import RedisError
+from .logging_config import LOG_FILE
+import hmac
 import os
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
+LOG_TAIL_CACHE_KEY = "admin:log_tail"
+LOG_TAIL_CACHE_TTL = 3  # seconds
+
+_ADMIN_TOKEN = get_secret("ADMIN_SECRET").encode()
+
 def verify_admin(request: Request):
-    if request.headers.get("X-Admin-Token") != config.ADMIN_SECRET:
+    token = request.headers.get("X-Admin-Token", "").encode()
+    if not hmac.compare_digest(token, _ADMIN_TOKEN):
         raise HTTPException(status_code=403)
     return True
 
+def tail_lines(path: str, n: int = 100, block: int = 8192) -> list:
+    """Return the last n lines of a file by reading blocks backwards from the end"""
+    if not os.path.exists(path):
+        return []
+
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buf = b""
+        # Stop once we have one more newline than needed so the oldest line is complete
+        while pos > 0 and buf.count(b"\n") <= n:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+
+    return [line.decode("utf-8", errors="replace") for line in buf.splitlines(keepends=True)[-n:]]
+
 @router.get("/admin", response_class=HTMLResponse)
 async def admin_dashboard(request: Request, auth=Depends(verify_admin)):
-    logs = []
-    log_file = "logs/api.log"
-    
-    if os.path.exists(log_file):
-        with open(log_file, "r") as f:
-            logs = f.readlines()[-100:]  # Get last 100 lines
-            
+    redis = request.app.state.redis
+    try:
+        cached = await redis.get(LOG_TAIL_CACHE_KEY)
+    except RedisError:
+        cached = None
+
+    if cached is not None:
+        logs = cached.splitlines(keepends=True)
+    else:
+        logs = tail_lines(LOG_FILE, 100)
+        try:
+            await redis.set(LOG_TAIL_CACHE_KEY, "".join(logs), ex=LOG_TAIL_CACHE_TTL)
+        except RedisError:
+            # The cache is only an optimisation; serve the fresh tail regardless
+            pass
+
     return templates.TemplateResponse(
         "dashboard.html",
         {"request": request, "logs": reversed(logs)}
@@ -1,6 +1,8 @@
-from pydantic import BaseSettings, AnyUrl, IPvAnyAddress, PostgresDsn, RedisDsn, SecretStr
+from pydantic import BaseSettings, AnyUrl, PostgresDsn, RedisDsn, SecretStr
 from typing import Optional, Literal
 from dotenv import load_dotenv
+from functools import lru_cache
+from types import MappingProxyType
 import logging
 
 # Load .env file before settings initialization
@@ -12,10 +14,15 @@ class AppSettings(BaseSettings):
     DATABASE_POOL_MIN: int = 2
     DATABASE_POOL_MAX: int = 10
     DATABASE_TIMEOUT: int = 30
+    DATABASE_COMMAND_TIMEOUT: int = 5
+    DATABASE_MAX_QUERIES: int = 50000
+    DATABASE_MAX_INACTIVE_CONNECTION_LIFETIME: float = 300.0  # in seconds
+    DATABASE_STATEMENT_CACHE_SIZE: int = 1024
     
     # Redis Configuration
     REDIS_URL: RedisDsn = "redis://localhost:6379/0"
     REDIS_MAX_CONNECTIONS: int = 20
+    REDIS_POOL_TIMEOUT: int = 5  # seconds to wait for a free connection
     
     # API Security
     CUSTOMER_API_KEY: SecretStr
@@ -24,11 +31,13 @@ class AppSettings(BaseSettings):
     ADMIN_SECRET: SecretStr
     
     # Network Security
-    WHITELISTED_IP: IPvAnyAddress = "127.0.0.1"
+    WHITELISTED_IP: str = "127.0.0.1"  # comma-separated addresses and/or CIDR networks
     CORS_ORIGINS: list[str] = ["*"]
     
     # Monitoring & Observability
     SENTRY_DSN: Optional[AnyUrl] = None
+    SENTRY_TRACES_SAMPLE_RATE: float = 0.05  # ignored in development, which traces everything
+    SENTRY_PROFILES_SAMPLE_RATE: float = 0.1  # fraction of sampled transactions that are profiled
     LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
     
     # Application Environment
@@ -37,7 +46,12 @@ class AppSettings(BaseSettings):
     
     # Rate Limiting
     RATE_LIMIT: int = 100
+    CHATLOG_RATE_LIMIT: int = 500  # chat-logs is the high-volume endpoint
     RATE_LIMIT_PERIOD: int = 60  # in seconds
+    RATE_LIMIT_INSTANCES: Optional[int] = None  # processes sharing the limit (replicas x workers); unset reports every request to Redis
+    STRICT_SLIDING_WINDOW: bool = False  # exact sliding log instead of the cheaper fixed-window counter
+    CONCURRENCY_LIMIT: int = 10  # in-flight requests per client
+    CONCURRENCY_TIMEOUT: int = 60  # in seconds, before a leaked slot is reclaimed
     
     class Config:
         env_file = ".env"
@@ -63,37 +77,40 @@ class AppSettings(BaseSettings):
 try:
     settings = AppSettings()
 except Exception as e:
-    logging.error(f"Failed to load configuration: {e}")
+    logging.error("Failed to load configuration: %s", e)
     raise
 
-# Configure logging immediately
-logging.basicConfig(
-    level=settings.LOG_LEVEL,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
 # Helper functions for specific config groups
+# Settings are immutable for the process lifetime, so each group is built once
+@lru_cache(maxsize=None)
+def get_secret(name: str) -> str:
+    """Unwrap a SecretStr setting once and reuse the plain value"""
+    return getattr(settings, name).get_secret_value()
+
+@lru_cache(maxsize=1)
 def get_database_config():
-    return {
+    return MappingProxyType({
         "url": settings.DATABASE_URL,
         "min_size": settings.DATABASE_POOL_MIN,
         "max_size": settings.DATABASE_POOL_MAX,
         "timeout": settings.DATABASE_TIMEOUT
-    }
+    })
 
+@lru_cache(maxsize=1)
 def get_redis_config():
-    return {
+    return MappingProxyType({
         "url": settings.REDIS_URL,
         "max_connections": settings.REDIS_MAX_CONNECTIONS,
         "encoding": "utf-8",
         "decode_responses": True
-    }
+    })
 
+@lru_cache(maxsize=1)
 def get_security_config():
-    return {
-        "customer_key": settings.CUSTOMER_API_KEY.get_secret_value(),
-        "billing_key": settings.BILLING_API_KEY.get_secret_value(),
-        "chatlog_key": settings.CHATLOG_API_KEY.get_secret_value(),
-        "admin_secret": settings.ADMIN_SECRET.get_secret_value(),
+    return MappingProxyType({
+        "customer_key": get_secret("CUSTOMER_API_KEY"),
+        "billing_key": get_secret("BILLING_API_KEY"),
+        "chatlog_key": get_secret("CHATLOG_API_KEY"),
+        "admin_secret": get_secret("ADMIN_SECRET"),
         "whitelisted_ip": settings.WHITELISTED_IP
-    }
+    })
@@ -1,6 +1,5 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from config import config
 
 SQLALCHEMY_DATABASE_URL = config.DATABASE_URL
@@ -11,13 +10,5 @@ engine = create_engine(
     pool_size=20,
     max_overflow=30
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
@@ -0,0 +1,78 @@
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import orjson
+
+# Shared by every worker process; rotate it externally (logrotate with a plain
+# move, no copytruncate) and WatchedFileHandler reopens it on the next write
+LOG_FILE = "logs/api.log"
+# The admin dashboard splits file lines on " - ", so the file sink keeps this layout
+LOG_FILE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes present on every LogRecord; anything else was passed through ``extra=``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class ORJSONFormatter(logging.Formatter):
+    """Render each log record as a single JSON line using orjson"""
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc_info"] = record.exc_text
+        # extra= values may hold dicts keyed by ints, UUIDs etc.; default= only covers values
+        return orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that hands the traceback to the sinks as text
+
+    The stock ``prepare()`` folds the traceback into the message and clears
+    ``exc_info``, so sink formatters never see it as a separate field.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Traceback objects pin their frames; render the text before queueing
+            record.exc_text = record.exc_text or _TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def configure_logging(level: str) -> logging.handlers.QueueListener:
+    """Route all records through a queue so file and stream writes happen off the event loop
+
+    Returns the started listener; call ``stop()`` on shutdown to flush it.
+    """
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(ORJSONFormatter())
+
+    # Each worker appends to the same file; RotatingFileHandler would let every
+    # worker rename it independently, so rotation is left to the host
+    file_handler = logging.handlers.WatchedFileHandler(LOG_FILE, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(LOG_FILE_FORMAT))
+
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, file_handler, respect_handler_level=True
+    )
+    queue_handler = _QueueHandler(log_queue)
+    # force=True replaces any handler an early module-level logging call may have installed
+    logging.basicConfig(level=level, handlers=[queue_handler], force=True)
+    listener.start()
+    return listener
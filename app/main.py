@@ -1,58 +1,177 @@
-import json
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends, HTTPException, status
 from fastapi.middleware import Middleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.encoders import jsonable_encoder
 from slowapi.errors import RateLimitExceeded
 from .middleware import IPWhitelistMiddleware, APIKeyAuthMiddleware, RequestContextMiddleware
-from .rate_limiter import limiter
+from .rate_limiter import limiter, ENDPOINT_LIMITS, limit_concurrency, register_rate_limit_scripts
 from .models import CustomerCreate, Payment, ChatLog
 from .admin import router as admin_router
-from .database import get_db
 from .security import validate_api_key
 from .config import settings
 from .monitoring import setup_monitoring
 from .cache import cache_response
+from .logging_config import configure_logging
 import asyncpg
-import aioredis
+import orjson
+from redis.asyncio import BlockingConnectionPool, Redis
 import logging
 from datetime import datetime
 from typing import AsyncGenerator, Dict, Any
+import time
 import uuid
 
-# Configure structured logging
-logging.basicConfig(
-    level=settings.LOG_LEVEL,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s - %(request_id)s'
-)
 logger = logging.getLogger(__name__)
 
+CUSTOMER_UPSERT_SQL = """INSERT INTO customers (name, phone, region) 
+    VALUES ($1, $2, $3)
+    ON CONFLICT (phone) DO UPDATE SET 
+    name = EXCLUDED.name, region = EXCLUDED.region
+    RETURNING id"""
+
+CUSTOMER_CACHE_TTL = 86400  # seconds
+
+async def cache_customer(redis: Redis, customer_data: Dict[str, Any]) -> None:
+    """Store the customer hash and its expiry in a single round trip"""
+    key = f"customer:{customer_data['id']}"
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping=customer_data)
+        pipe.expire(key, CUSTOMER_CACHE_TTL)
+        await pipe.execute()
+
+class PreparedConnection(asyncpg.Connection):
+    """asyncpg connection carrying the handler statements prepared at pool init"""
+    __slots__ = ("customer_upsert",)
+
+async def _prepare_statements(conn: PreparedConnection) -> None:
+    conn.customer_upsert = await conn.prepare(CUSTOMER_UPSERT_SQL)
+
+CLOCK_TICK_INTERVAL = 0.25  # seconds
+
+def _utc_now_iso() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+async def _tick_clock(app: FastAPI) -> None:
+    """Refresh app.state.now_iso so handlers read a cached timestamp instead of formatting one"""
+    while True:
+        app.state.now_iso = _utc_now_iso()
+        await asyncio.sleep(CLOCK_TICK_INTERVAL)
+
+HEALTH_CHECK_INTERVAL = 1  # seconds
+HEALTH_CHECK_TIMEOUT = 2  # seconds per dependency; a hung check counts as a failure
+# A snapshot older than this means the probe itself is stuck or dead
+HEALTH_SNAPSHOT_MAX_AGE = 3 * (HEALTH_CHECK_INTERVAL + 2 * HEALTH_CHECK_TIMEOUT)
+
+async def _ping_database(pool: asyncpg.Pool) -> None:
+    async with pool.acquire() as conn:
+        await conn.execute("SELECT 1")
+
+async def _check_health(app: FastAPI) -> Dict[str, Any]:
+    checks = {
+        "database": False,
+        "redis": False,
+        "status": "healthy",
+        "checked_at": _utc_now_iso()
+    }
+    
+    try:
+        # Check database connection
+        await asyncio.wait_for(_ping_database(app.state.pg_pool), HEALTH_CHECK_TIMEOUT)
+        checks["database"] = True
+    except asyncio.TimeoutError:
+        checks["status"] = "degraded"
+        logger.warning("Database health check timed out")
+    except Exception as e:
+        checks["database"] = False
+        checks["status"] = "degraded"
+        logger.warning("Database health check failed: %s", e)
+    
+    try:
+        # Check Redis connection
+        await asyncio.wait_for(app.state.redis.ping(), HEALTH_CHECK_TIMEOUT)
+        checks["redis"] = True
+    except asyncio.TimeoutError:
+        checks["status"] = "degraded"
+        logger.warning("Redis health check timed out")
+    except Exception as e:
+        checks["redis"] = False
+        checks["status"] = "degraded"
+        logger.warning("Redis health check failed: %s", e)
+
+    return checks
+
+async def _refresh_health(app: FastAPI) -> None:
+    app.state.health = await _check_health(app)
+    app.state.health_checked = time.monotonic()
+
+async def _probe_health(app: FastAPI) -> None:
+    """Refresh app.state.health so /health never touches the pools itself"""
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+        await _refresh_health(app)
+
+def run_in_background(request: Request, coro) -> asyncio.Task:
+    """Schedule follow-up work (cache writes, pub/sub) without holding the response"""
+    task = asyncio.create_task(coro)
+    tasks = request.app.state.bg_tasks
+    tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    task.add_done_callback(tasks.discard)
+    return task
+
+def _background_task_done(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task failed", exc_info=task.exception())
+
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     """Async context manager for app lifespan management with health checks"""
+    # The only place logging is configured; the listener is flushed on shutdown
+    log_listener = configure_logging(settings.LOG_LEVEL)
     try:
+        # Strong references to fire-and-forget tasks spawned by handlers
+        app.state.bg_tasks = set()
+        # Second-resolution timestamp shared by all handlers
+        app.state.now_iso = _utc_now_iso()
+        app.state.clock = asyncio.create_task(_tick_clock(app))
+
         # Initialize connection pools with health checks
         app.state.pg_pool = await asyncpg.create_pool(
             dsn=settings.DATABASE_URL,
             min_size=settings.DATABASE_POOL_MIN,
             max_size=settings.DATABASE_POOL_MAX,
             timeout=settings.DATABASE_TIMEOUT,
-            command_timeout=5
+            command_timeout=settings.DATABASE_COMMAND_TIMEOUT,
+            max_queries=settings.DATABASE_MAX_QUERIES,
+            max_inactive_connection_lifetime=settings.DATABASE_MAX_INACTIVE_CONNECTION_LIFETIME,
+            statement_cache_size=settings.DATABASE_STATEMENT_CACHE_SIZE,
+            connection_class=PreparedConnection,
+            init=_prepare_statements
         )
         # Verify database connection
         async with app.state.pg_pool.acquire() as conn:
             await conn.execute("SELECT 1")
         
-        app.state.redis = await aioredis.from_url(
+        # Blocking pool: callers wait for a free socket instead of opening unbounded ones
+        app.state.redis_pool = BlockingConnectionPool.from_url(
             settings.REDIS_URL,
             encoding="utf-8",
             decode_responses=True,
-            max_connections=settings.REDIS_MAX_CONNECTIONS
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            health_check_interval=30
         )
+        app.state.redis = Redis(connection_pool=app.state.redis_pool)
         # Verify Redis connection
         await app.state.redis.ping()
+        register_rate_limit_scripts(app)
+
+        # Probe DB and Redis once per interval regardless of how often /health is hit
+        await _refresh_health(app)
+        app.state.health_probe = asyncio.create_task(_probe_health(app))
         
         logger.info("Application startup complete", extra={
             "db_connections": settings.DATABASE_POOL_MIN,
@@ -62,22 +181,33 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
         yield
         
     except Exception as e:
-        logger.critical(f"Startup failed: {str(e)}", exc_info=True)
+        logger.critical("Startup failed: %s", e, exc_info=True)
         raise
         
     finally:
+        if hasattr(app.state, 'clock'):
+            app.state.clock.cancel()
+        if hasattr(app.state, 'health_probe'):
+            app.state.health_probe.cancel()
+
         # Cleanup resources with timeout
         try:
+            if getattr(app.state, 'bg_tasks', None):
+                await asyncio.wait(app.state.bg_tasks, timeout=5)
             if hasattr(app.state, 'pg_pool'):
                 await asyncio.wait_for(app.state.pg_pool.close(), timeout=5)
             if hasattr(app.state, 'redis'):
                 await asyncio.wait_for(app.state.redis.close(), timeout=5)
+                await asyncio.wait_for(app.state.redis_pool.disconnect(), timeout=5)
             logger.info("Application shutdown complete")
         except asyncio.TimeoutError:
             logger.error("Resource cleanup timed out")
+        finally:
+            log_listener.stop()
 
 app = FastAPI(
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     middleware=[
         Middleware(RequestContextMiddleware),  # Adds request_id and timing
         Middleware(IPWhitelistMiddleware),
@@ -97,26 +227,35 @@ setup_monitoring(app)
 app.include_router(admin_router, prefix="/admin")
 app.state.limiter = limiter
 
+# The 429 body only varies in retry_after and request_id, so the constant
+# part is serialized once and the two values are spliced in per response
+_RATE_LIMIT_BODY_PREFIX = orjson.dumps({
+    "status": "error",
+    "code": "rate_limit_exceeded",
+    "message": "Too many requests",
+    "limit": settings.RATE_LIMIT,
+    "documentation_url": settings.DOCS_URL
+})[:-1] + b',"retry_after":'
+
 # Enhanced exception handlers
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
-    return JSONResponse(
+    return Response(
+        content=(
+            _RATE_LIMIT_BODY_PREFIX
+            + orjson.dumps(exc.retry_after)
+            + b',"request_id":'
+            + orjson.dumps(request.state.request_id)
+            + b"}"
+        ),
         status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-        content=jsonable_encoder({
-            "status": "error",
-            "code": "rate_limit_exceeded",
-            "message": "Too many requests",
-            "limit": settings.RATE_LIMIT,
-            "retry_after": exc.retry_after,
-            "request_id": request.state.request_id,
-            "documentation_url": settings.DOCS_URL
-        }),
+        media_type="application/json",
         headers={"Retry-After": str(exc.retry_after)}
     )
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content=jsonable_encoder({
             "status": "error",
@@ -130,10 +269,10 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     error_id = str(uuid.uuid4())
-    logger.critical(f"Unhandled exception - {error_id}: {str(exc)}", exc_info=True,
+    logger.critical("Unhandled exception - %s: %s", error_id, exc, exc_info=True,
                   extra={"request_id": request.state.request_id})
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={
             "status": "error",
@@ -145,25 +284,23 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 # API endpoints with enhanced features
-@app.post("/customers", status_code=status.HTTP_201_CREATED)
-@limiter.limit(f"{settings.RATE_LIMIT}/minute")
+@app.post(
+    "/customers",
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(limit_concurrency)]
+)
+@ENDPOINT_LIMITS["customers"]
 @cache_response(key_prefix="customer", ttl=3600)
 async def create_customer(
     data: CustomerCreate, 
-    request: Request,
-    db=Depends(get_db)
-) -> Dict[str, Any]:
+    request: Request
+) -> ORJSONResponse:
     """Create a new customer with data validation and caching"""
     try:
-        async with db.acquire() as connection:
+        async with request.app.state.pg_pool.acquire() as connection:
             async with connection.transaction():
                 # Insert with conflict handling
-                customer_id = await connection.fetchval(
-                    """INSERT INTO customers (name, phone, region) 
-                    VALUES ($1, $2, $3)
-                    ON CONFLICT (phone) DO UPDATE SET 
-                    name = EXCLUDED.name, region = EXCLUDED.region
-                    RETURNING id""",
+                customer_id = await connection.customer_upsert.fetchval(
                     data.name, data.phone, data.region
                 )
                 
@@ -172,28 +309,33 @@ async def create_customer(
                     "name": data.name,
                     "phone": data.phone,
                     "region": data.region,
-                    "created_at": datetime.utcnow().isoformat()
+                    "created_at": request.app.state.now_iso
                 }
                 
-                # Cache customer data
-                await request.app.state.redis.hset(
-                    f"customer:{customer_id}",
-                    mapping=customer_data
+                # Cache customer data once the response is on its way
+                run_in_background(
+                    request, cache_customer(request.app.state.redis, customer_data)
                 )
                 
+                # Only enqueues the record; the QueueListener thread does the I/O
                 logger.info("Customer created/updated", extra={
                     "customer_id": customer_id,
                     "operation": "create_customer"
                 })
                 
-                return {
-                    "status": "success",
-                    "data": customer_data,
-                    "timestamp": datetime.utcnow().isoformat()
-                }
+                # Returned as a Response so the body is encoded by orjson
+                # directly, skipping response_model validation and jsonable_encoder
+                return ORJSONResponse(
+                    status_code=status.HTTP_201_CREATED,
+                    content={
+                        "status": "success",
+                        "data": customer_data,
+                        "timestamp": request.app.state.now_iso
+                    }
+                )
                 
     except asyncpg.PostgresError as e:
-        logger.error(f"Database error: {str(e)}", extra={
+        logger.error("Database error: %s", e, extra={
             "request_id": request.state.request_id
         })
         raise HTTPException(
@@ -207,35 +349,14 @@ async def create_customer(
 # Health check endpoint with system status
 @app.get("/health", include_in_schema=False)
 async def health_check(request: Request) -> Dict[str, Any]:
-    """Comprehensive health check endpoint"""
-    checks = {
-        "database": False,
-        "redis": False,
-        "status": "healthy"
-    }
-    
-    try:
-        # Check database connection
-        async with request.app.state.pg_pool.acquire() as conn:
-            await conn.execute("SELECT 1")
-            checks["database"] = True
-    except Exception as e:
-        checks["database"] = False
-        checks["status"] = "degraded"
-        logger.warning(f"Database health check failed: {str(e)}")
-    
-    try:
-        # Check Redis connection
-        await request.app.state.redis.ping()
-        checks["redis"] = True
-    except Exception as e:
-        checks["redis"] = False
-        checks["status"] = "degraded"
-        logger.warning(f"Redis health check failed: {str(e)}")
-    
+    """Comprehensive health check endpoint, served from the background probe snapshot"""
+    health = request.app.state.health
+    if time.monotonic() - request.app.state.health_checked > HEALTH_SNAPSHOT_MAX_AGE:
+        # The probe has stopped updating; don't report its last result as current
+        health = {**health, "status": "degraded", "stale": True}
     return {
-        **checks,
+        **health,
         "version": settings.VERSION,
         "environment": settings.ENVIRONMENT,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": request.app.state.now_iso
         }
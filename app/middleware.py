@@ -1,23 +1,77 @@
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
-from config import config
+from .config import get_secret, settings
+from functools import lru_cache
+import hmac
+import ipaddress
+import socket
+from sys import intern
+
+def _pack_ip(host: str) -> bytes:
+    """Packed network-order address; equal for every textual form of the same IP"""
+    return socket.inet_pton(socket.AF_INET6 if ":" in host else socket.AF_INET, host)
+
+def _parse_whitelist(value: str):
+    """Split WHITELISTED_IP into packed single addresses and CIDR networks"""
+    exact, networks = set(), []
+    for entry in str(value).split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if "/" in entry:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        else:
+            exact.add(ipaddress.ip_address(entry).packed)
+    return frozenset(exact), tuple(networks)
+
+# Parsed once at import so the common single-address case is one set lookup
+_WHITELIST_EXACT, _WHITELIST_NETS = _parse_whitelist(settings.WHITELISTED_IP)
+
+@lru_cache(maxsize=4096)
+def _in_whitelisted_network(host: str) -> bool:
+    address = ipaddress.ip_address(host)
+    return any(address in network for network in _WHITELIST_NETS)
+
+# Scrape and probe endpoints, called from inside the cluster rather than by API clients
+_UNRESTRICTED_PATHS = frozenset({"/metrics", "/health"})
 
 class IPWhitelistMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        if request.client.host != config.WHITELISTED_IP:
+        if request.scope["path"] in _UNRESTRICTED_PATHS:
+            return await call_next(request)
+
+        client = request.scope.get("client")
+        try:
+            allowed = client is not None and (
+                _pack_ip(client[0]) in _WHITELIST_EXACT
+                or (bool(_WHITELIST_NETS) and _in_whitelisted_network(client[0]))
+            )
+        except (OSError, ValueError):
+            allowed = False
+        if not allowed:
             raise HTTPException(status_code=403, detail="IP not allowed")
         return await call_next(request)
 
+# Expected API key per first path segment, encoded once for constant-time comparison.
+# Built in a single pass at import; add a route here rather than another if-branch.
+_PATH_KEY = {
+    intern(segment): key.encode()
+    for segment, key in (
+        ("customers", get_secret("CUSTOMER_API_KEY")),
+        ("payments", get_secret("BILLING_API_KEY")),
+        ("chat-logs", get_secret("CHATLOG_API_KEY")),
+    )
+}
+
 class APIKeyAuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        path = request.url.path
-        api_key = request.headers.get("X-API-Key", "")
-
-        if "/customers" in path and api_key != config.CUSTOMER_API_KEY:
-            raise HTTPException(status_code=401)
-        if "/payments" in path and api_key != config.BILLING_API_KEY:
-            raise HTTPException(status_code=401)
-        if "/chat-logs" in path and api_key != config.CHATLOG_API_KEY:
-            raise HTTPException(status_code=401)
+        path = request.scope["path"]
+        segment = path.split("/", 2)[1] if len(path) > 1 else ""
+        expected = _PATH_KEY.get(segment)
+
+        if expected is not None:
+            api_key = request.headers.get("X-API-Key", "").encode()
+            if not hmac.compare_digest(api_key, expected):
+                raise HTTPException(status_code=401)
 
         return await call_next(request)
@@ -1,23 +1,48 @@
-from pydantic import BaseModel, constr, validator
-from datetime import datetime
+from pydantic import BaseModel, Field, validator
+from datetime import datetime, timezone
 from typing import Optional
+import orjson
+import re
+import time
 
-class CustomerCreate(BaseModel):
+def _orjson_dumps(v, *, default):
+    # pydantic v1 expects json_dumps to return str
+    return orjson.dumps(v, default=default).decode()
+
+class ORJSONModel(BaseModel):
+    """Base model whose .json()/.parse_raw() go through orjson instead of stdlib json"""
+    class Config:
+        json_loads = orjson.loads
+        json_dumps = _orjson_dumps
+
+# \Z rather than $ so a trailing newline is not accepted
+_PHONE_RE = re.compile(r"^09\d{7,9}\Z")
+
+class CustomerCreate(ORJSONModel):
     name: str
-    phone: constr(regex=r"^09\d{7,9}$")
+    phone: str
     region: str
     notes: Optional[str] = None
 
-class Payment(BaseModel):
+    @validator("phone")
+    def validate_phone(cls, v):
+        if not _PHONE_RE.match(v):
+            raise ValueError("phone must be 09 followed by 7-9 digits")
+        return v
+
+def _utc_now() -> datetime:
+    return datetime.fromtimestamp(time.time(), tz=timezone.utc)
+
+class Payment(ORJSONModel):
     user_id: str
     amount: float
     method: str
     reference_id: str
-    timestamp: datetime = datetime.utcnow()
+    timestamp: datetime = Field(default_factory=_utc_now)
 
-class ChatLog(BaseModel):
+class ChatLog(ORJSONModel):
     viber_id: str
     message: str
-    timestamp: datetime = datetime.utcnow()
+    timestamp: datetime = Field(default_factory=_utc_now)
     type: str
     status: str = "received"
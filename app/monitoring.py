@@ -1,5 +1,4 @@
 import sentry_sdk
-from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 from sentry_sdk.integrations.redis import RedisIntegration
 from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from sentry_sdk.integrations.logging import LoggingIntegration
@@ -9,10 +8,32 @@ from fastapi import FastAPI
 from config import settings
 import logging
 
+logger = logging.getLogger(__name__)
+
+# Probe and scrape endpoints are hit every few seconds and never worth a trace
+_UNTRACED_PATHS = frozenset({"/metrics", "/health"})
+
+def _traces_sampler(sampling_context) -> float:
+    """Per-transaction sample rate: follow the upstream decision, skip probes, sample the rest"""
+    parent_sampled = sampling_context.get("parent_sampled")
+    if parent_sampled is not None:
+        return float(parent_sampled)
+    if sampling_context.get("asgi_scope", {}).get("path") in _UNTRACED_PATHS:
+        return 0.0
+    if settings.ENVIRONMENT == "development":
+        return 1.0
+    return settings.SENTRY_TRACES_SAMPLE_RATE
+
+def _before_send_transaction(event, hint):
+    """Drop probe/scrape transactions that were still sampled, e.g. via an upstream trace"""
+    if event.get("transaction") in _UNTRACED_PATHS:
+        return None
+    return event
+
 def configure_sentry():
     """Configure Sentry SDK with appropriate integrations"""
     if not settings.SENTRY_DSN:
-        logging.warning("Sentry DSN not configured - skipping Sentry setup")
+        logger.warning("Sentry DSN not configured - skipping Sentry setup")
         return False
 
     sentry_logging = LoggingIntegration(
@@ -29,8 +50,9 @@ def configure_sentry():
             sentry_logging
         ],
         environment=settings.ENVIRONMENT,
-        traces_sample_rate=1.0,
-        profiles_sample_rate=1.0 if settings.ENVIRONMENT == "production" else 0.1,
+        traces_sampler=_traces_sampler,
+        before_send_transaction=_before_send_transaction,
+        profiles_sample_rate=1.0 if settings.ENVIRONMENT == "development" else settings.SENTRY_PROFILES_SAMPLE_RATE,
         send_default_pii=False,
         debug=settings.DEBUG,
         release=f"viber-bot@{settings.VERSION}" if hasattr(settings, 'VERSION') else None
@@ -44,39 +66,31 @@ def configure_metrics(app: FastAPI):
         should_ignore_untemplated=True,
         should_respect_env_var=True,
         should_instrument_requests_inprogress=True,
-        excluded_handlers=["/metrics", "/health"],
+        # Anchored so the library's compiled patterns match only these exact paths
+        excluded_handlers=[r"^/metrics$", r"^/health$"],
         env_var_name="ENABLE_METRICS",
         inprogress_name="inprogress",
-        inprogress_labels=True
+        inprogress_labels=False
     ).instrument(app).expose(
         app,
         endpoint="/metrics",
         include_in_schema=False,
-        should_gzip=True
+        should_gzip=False
     )
 
-    logging.info("Prometheus metrics configured at /metrics")
+    logger.info("Prometheus metrics configured at /metrics")
 
 def setup_monitoring(app: FastAPI):
     """Main monitoring setup function"""
     # Configure Sentry
     sentry_configured = configure_sentry()
     if sentry_configured:
-        app.add_middleware(SentryAsgiMiddleware)
-        logging.info("Sentry monitoring configured")
+        # FastApiIntegration already wraps the app; adding SentryAsgiMiddleware
+        # on top would open a second scope and transaction per request
+        logger.info("Sentry monitoring configured")
 
     # Configure Metrics
     if settings.MONITORING_ENABLED:
         configure_metrics(app)
-        
-    # Health check endpoint
-    @app.get("/health", include_in_schema=False)
-    async def health_check():
-        return {
-            "status": "healthy",
-            "environment": settings.ENVIRONMENT,
-            "monitoring": {
-                "sentry": sentry_configured,
-                "prometheus": settings.MONITORING_ENABLED
-            }
-        }
+
+    # /health is served by app.main from the background probe snapshot
@@ -1,14 +1,15 @@
+import hashlib
 import time
+import uuid
 from typing import Optional
+from cachetools import TTLCache
 from fastapi import Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from config import settings
-import aioredis
-import ujson
+from redis.exceptions import RedisError
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from contextlib import asynccontextmanager
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,90 +21,188 @@ class EnhancedLimiter(Limiter):
             default_limits=[f"{settings.RATE_LIMIT} per minute"]
         )
     
-    async def _enhanced_key_func(self, request: Request) -> str:
-        """Enhanced key function that considers both IP and API key"""
+    def _enhanced_key_func(self, request: Request) -> str:
+        """Enhanced key function that considers both IP and API key
+
+        Must stay synchronous: slowapi and sliding_window_rate_limiter call it
+        without awaiting, and an async version handed back a coroutine as the key.
+        """
         client_ip = get_remote_address(request)
-        api_key = request.headers.get("X-API-Key", "")
-        return f"{client_ip}:{api_key}"
+        api_key = request.headers.get("X-API-Key")
+        return f"{client_ip}:{api_key}" if api_key else client_ip
 
 limiter = EnhancedLimiter()
 
-@asynccontextmanager
-async def redis_connection(request: Request):
-    """Context manager for Redis connection handling"""
-    try:
-        if not hasattr(request.app.state, 'redis'):
-            request.app.state.redis = await aioredis.from_url(
-                settings.REDIS_URL,
-                encoding="utf-8",
-                decode_responses=True
-            )
-        yield request.app.state.redis
-    except aioredis.RedisError as e:
-        logger.error(f"Redis connection error: {str(e)}")
-        raise HTTPException(
-            status_code=503,
-            detail="Service temporarily unavailable"
-        )
+# Per-endpoint limit decorators, keyed by the route's first path segment.
+# Limit strings are built once here and each endpoint decorates from the table.
+ENDPOINT_LIMITS = {
+    "customers": limiter.limit(f"{settings.RATE_LIMIT}/minute"),
+    "payments": limiter.limit(f"{settings.RATE_LIMIT}/minute"),
+    "chat-logs": limiter.limit(f"{settings.CHATLOG_RATE_LIMIT}/minute"),
+}
+
+# Trim the window, count, and admit in one atomic server-side step.
+# ZCARD runs before ZADD so members that won't be admitted are never written.
+# Returns {admitted, count including this request if admitted}.
+SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+if count < tonumber(ARGV[3]) then
+    redis.call('ZADD', key, now, ARGV[4])
+    redis.call('EXPIRE', key, math.floor(window / 1000) + 10)
+    return {1, count + 1}
+end
+return {0, count}
+"""
+
+# Fixed-window counter: one small string key per client per window instead of
+# one sorted-set member per request. Returns the same {admitted, count} shape.
+# ARGV[3] is the number of requests being reported (the local batch plus this one).
+FIXED_WINDOW_LUA = """
+local increment = tonumber(ARGV[3])
+local count = redis.call('INCRBY', KEYS[1], increment)
+if count == increment then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+if count > tonumber(ARGV[2]) then
+    return {0, count}
+end
+return {1, count}
+"""
+
+# Header values that only depend on settings, formatted once
+_LIMIT_STR = str(settings.RATE_LIMIT)
+_EXCEEDED_HEADERS = {"X-RateLimit-Limit": _LIMIT_STR, "X-RateLimit-Remaining": "0"}
+
+def _local_budget(instances: Optional[int]) -> int:
+    """Requests a process may admit per client and window before reporting to Redis
+
+    80% of its share so instances can't overshoot much. Without a known
+    instance count no share can be computed, so nothing is batched.
+    """
+    return int(settings.RATE_LIMIT / instances * 0.8) if instances else 0
+
+_INSTANCES = settings.RATE_LIMIT_INSTANCES
+_LOCAL_BUDGET = _local_budget(_INSTANCES)
+
+class _LocalWindow:
+    """Requests admitted in-process for one fixed-window key, not yet reported to Redis"""
+    __slots__ = ("pending", "budget", "count")
+
+    def __init__(self):
+        self.pending = 0
+        self.budget = _LOCAL_BUDGET
+        self.count = 0  # last count seen in Redis
+
+    def update(self, admitted: int, count: int):
+        """Size the next local batch from the remaining global allowance
+
+        Other instances may hold up to one batch each that Redis hasn't seen
+        yet, so the remainder is split N*N ways: together the unreported
+        batches stay within 1/N of what is actually left.
+        """
+        self.count = max(self.count, count)
+        if not admitted:
+            self.budget = -1  # over the limit for the rest of this window
+        elif _LOCAL_BUDGET:
+            remaining = max(0, settings.RATE_LIMIT - self.count)
+            self.budget = min(_LOCAL_BUDGET, remaining // _INSTANCES ** 2)
+
+_local_windows = TTLCache(maxsize=10_000, ttl=settings.RATE_LIMIT_PERIOD)
 
 async def sliding_window_rate_limiter(request: Request, call_next):
-    """Sliding window rate limiter using Redis sorted sets"""
-    async with redis_connection(request) as redis:
-        identifier = limiter._enhanced_key_func(request)
-        current_time = int(time.time())
-        window_size = 60  # seconds
-        
+    """Rate limiter backed by Redis, fixed-window by default
+
+    With STRICT_SLIDING_WINDOW the sliding log (sorted set) is used: the
+    window is trimmed and counted before the request is added, so a
+    rejected request never occupies a slot and the limit is exact at the
+    boundary (the request is admitted while count < RATE_LIMIT).
+    Otherwise a per-window INCR counter is used, which is cheaper in both
+    Redis CPU and memory but allows up to 2x RATE_LIMIT across a window edge.
+    In that mode requests are first counted in-process and reported to Redis
+    in batches, so most requests under the limit never touch Redis.
+    """
+    redis = request.app.state.redis
+    identifier = limiter._enhanced_key_func(request)
+    # Integer milliseconds: no float rounding and finer than second-level bursts
+    now_ms = time.time_ns() // 1_000_000
+    window_ms = settings.RATE_LIMIT_PERIOD * 1000
+
+    script = local = None
+
+    # Keys wrap the identifier in a {hash tag} so Redis Cluster puts every key
+    # for one client in the same slot and multi-key scripts never hit CROSSSLOT
+    if settings.STRICT_SLIDING_WINDOW:
+        key = f"rate_limit:{{{identifier}}}"
+        script = request.app.state.sliding_window_script
+        # Unique member so requests landing in the same millisecond are all counted
+        args = [now_ms, window_ms, settings.RATE_LIMIT, f"{now_ms}:{uuid.uuid4().hex[:8]}"]
+        reset_ms = now_ms + window_ms
+    else:
+        window_index = now_ms // window_ms
+        key = f"rate_limit:{{{identifier}}}:{window_index}"
+        reset_ms = (window_index + 1) * window_ms
+        local = _local_windows.get(key)
+        if local is None:
+            local = _local_windows[key] = _LocalWindow()
+
+        if local.budget < 0:
+            admitted, request_count = 0, local.count
+        elif local.pending < local.budget:
+            local.pending += 1
+            admitted, request_count = 1, local.count + local.pending
+        else:
+            script = request.app.state.fixed_window_script
+            batch, budget = local.pending + 1, local.budget
+            args = [settings.RATE_LIMIT_PERIOD, settings.RATE_LIMIT, batch]
+            # Hand the batch over now so concurrent requests don't report it twice
+            local.pending = local.budget = 0
+    
+    if script is not None:
         try:
-            # Use Redis pipeline for atomic operations
-            pipeline = redis.pipeline()
-            key = f"rate_limit:{identifier}"
-            
-            # Add current timestamp to the set
-            pipeline.zadd(key, {str(current_time): current_time})
-            
-            # Remove old timestamps (outside window)
-            pipeline.zremrangebyscore(key, 0, current_time - window_size)
-            
-            # Get count of remaining timestamps
-            pipeline.zcard(key)
-            
-            # Set expiration
-            pipeline.expire(key, window_size + 10)  # Extra buffer
-            
-            # Execute all commands
-            _, _, request_count, _ = await pipeline.execute()
-            
-            # Check rate limit
-            if request_count > settings.RATE_LIMIT:
-                reset_time = current_time + window_size
-                raise RateLimitExceeded(
-                    detail={
-                        "error": "rate_limit_exceeded",
-                        "limit": settings.RATE_LIMIT,
-                        "remaining": 0,
-                        "reset": reset_time
-                    },
-                    retry_after=reset_time - current_time
-                )
-            
-            # Add rate limit headers to response
-            response = await call_next(request)
-            response.headers.update({
-                "X-RateLimit-Limit": str(settings.RATE_LIMIT),
-                "X-RateLimit-Remaining": str(max(0, settings.RATE_LIMIT - request_count)),
-                "X-RateLimit-Reset": str(current_time + window_size)
-            })
-            
-            return response
-            
-        except aioredis.RedisError as e:
-            logger.error(f"Redis operation failed: {str(e)}")
+            # Script objects run EVALSHA and reload the source themselves on NOSCRIPT
+            admitted, request_count = await script(keys=[key], args=args, client=redis)
+        except RedisError as e:
+            logger.error("Redis operation failed: %s", e)
+            if local is not None:
+                # Keep the batch for the next report and go back to counting
+                # locally, rather than sending every request to a failing Redis
+                local.pending += batch
+                local.budget = local.pending + budget
             # Fail open - don't block requests if Redis is down
             return await call_next(request)
+        if local is not None:
+            local.update(admitted, request_count)
+    
+    reset_time = -(-reset_ms // 1000)  # round up to whole epoch seconds
+    
+    # Check rate limit
+    if not admitted:
+        raise RateLimitExceeded(
+            detail={
+                "error": "rate_limit_exceeded",
+                "limit": settings.RATE_LIMIT,
+                "remaining": 0,
+                "reset": reset_time
+            },
+            retry_after=reset_time - now_ms // 1000
+        )
+    
+    # Add rate limit headers to response
+    response = await call_next(request)
+    headers = response.headers
+    headers["X-RateLimit-Limit"] = _LIMIT_STR
+    headers["X-RateLimit-Remaining"] = str(max(0, settings.RATE_LIMIT - request_count))
+    headers["X-RateLimit-Reset"] = str(reset_time)
+    
+    return response
 
 async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
     """Enhanced rate limit exceeded handler"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=429,
         content={
             "status": "error",
@@ -113,17 +212,77 @@ async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
             "reset": exc.detail.get("reset")
         },
         headers={
+            **_EXCEEDED_HEADERS,
             "Retry-After": str(exc.retry_after),
-            "X-RateLimit-Limit": str(exc.detail.get("limit")),
-            "X-RateLimit-Remaining": str(exc.detail.get("remaining")),
             "X-RateLimit-Reset": str(exc.detail.get("reset"))
         }
     )
 
+# Drop stale slots, then admit the request only if the client is under its cap
+CONCURRENCY_LUA = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - timeout)
+if redis.call('ZCARD', key) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('EXPIRE', key, timeout)
+return 1
+"""
+
+def register_rate_limit_scripts(app):
+    """Register the limiter Lua scripts on the app Redis client"""
+    app.state.sliding_window_script = app.state.redis.register_script(SLIDING_WINDOW_LUA)
+    app.state.fixed_window_script = app.state.redis.register_script(FIXED_WINDOW_LUA)
+    app.state.concurrency_script = app.state.redis.register_script(CONCURRENCY_LUA)
+
+async def limit_concurrency(request: Request):
+    """Dependency capping in-flight requests per client with a Redis sorted set"""
+    # Same ip:key identity as the rate limiter; the API key alone is shared by
+    # every caller of an endpoint and would make this a global cap
+    identity = limiter._enhanced_key_func(request)
+    key = f"concurrency:{hashlib.sha256(identity.encode()).hexdigest()}"
+    member = uuid.uuid4().hex
+    redis = request.app.state.redis
+
+    try:
+        admitted = await request.app.state.concurrency_script(
+            keys=[key],
+            args=[time.time(), settings.CONCURRENCY_TIMEOUT, settings.CONCURRENCY_LIMIT, member],
+            client=redis
+        )
+    except RedisError as e:
+        logger.error("Concurrency limiter unavailable: %s", e)
+        # Fail open - don't block requests if Redis is down
+        admitted = None
+
+    if admitted is None:
+        yield
+        return
+    if not admitted:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "code": "concurrency_limit_exceeded",
+                "message": "Too many concurrent requests"
+            }
+        )
+
+    try:
+        yield
+    finally:
+        try:
+            await redis.zrem(key, member)
+        except RedisError as e:
+            logger.error("Failed to release concurrency slot: %s", e)
+
 def get_rate_limiter():
     """Get the configured rate limiter instance"""
     return {
         "limiter": limiter,
         "middleware": sliding_window_rate_limiter,
+        "concurrency_dependency": limit_concurrency,
         "exception_handler": rate_limit_exceeded_handler
         }
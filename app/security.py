@@ -1,17 +1,27 @@
 from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
-from config import config
+from .config import get_secret
+import hmac
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
+# Encoded once at import; each candidate is checked with compare_digest so the
+# time taken does not depend on how much of a key the caller got right
+_VALID_API_KEYS = tuple(
+    get_secret(name).encode()
+    for name in ("CUSTOMER_API_KEY", "BILLING_API_KEY", "CHATLOG_API_KEY")
+)
+_ADMIN_SECRET = get_secret("ADMIN_SECRET").encode()
+
 async def validate_api_key(api_key: str = Depends(api_key_header)):
     if not api_key:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="API key required"
         )
-    if api_key not in [config.CUSTOMER_API_KEY, config.BILLING_API_KEY, config.CHATLOG_API_KEY]:
+    candidate = api_key.encode()
+    if not any(hmac.compare_digest(key, candidate) for key in _VALID_API_KEYS):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid API key"
@@ -19,7 +29,7 @@ async def validate_api_key(api_key: str = Depends(api_key_header)):
     return api_key
 
 async def validate_admin_token(token: str = Depends(oauth2_scheme)):
-    if token != config.ADMIN_SECRET:
+    if not hmac.compare_digest((token or "").encode(), _ADMIN_SECRET):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid authentication credentials"
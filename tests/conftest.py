@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The app modules import each other as top-level modules (``from config import ...``)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+# Required settings without defaults
+for name in ("CUSTOMER_API_KEY", "BILLING_API_KEY", "CHATLOG_API_KEY", "ADMIN_SECRET"):
+    os.environ.setdefault(name, f"test_{name.lower()}")
@@ -0,0 +1,148 @@
+from types import SimpleNamespace
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+import rate_limiter
+from config import settings
+
+
+class FakeFixedWindowScript:
+    """In-memory stand-in for FIXED_WINDOW_LUA: INCRBY, then compare with the limit"""
+    def __init__(self):
+        self.counts = {}
+        self.calls = 0
+        self.fail = False
+
+    async def __call__(self, keys, args, client=None):
+        self.calls += 1
+        if self.fail:
+            raise RedisConnectionError("redis is down")
+        period, limit, increment = args
+        count = self.counts[keys[0]] = self.counts.get(keys[0], 0) + int(increment)
+        return [0, count] if count > int(limit) else [1, count]
+
+
+class Rejected(Exception):
+    def __init__(self, **kwargs):
+        super().__init__(kwargs)
+
+
+@pytest.fixture
+def instances(monkeypatch):
+    """Size the local budget for ``n`` processes sharing the limit"""
+    def configure(n):
+        monkeypatch.setattr(rate_limiter, "_INSTANCES", n)
+        monkeypatch.setattr(rate_limiter, "_LOCAL_BUDGET", rate_limiter._local_budget(n))
+    monkeypatch.setattr(settings, "STRICT_SLIDING_WINDOW", False)
+    # Only the admission decision is under test, not the 429 payload
+    monkeypatch.setattr(rate_limiter, "RateLimitExceeded", Rejected)
+    return configure
+
+
+def make_request(script):
+    state = SimpleNamespace(redis=None, fixed_window_script=script)
+    return SimpleNamespace(
+        app=SimpleNamespace(state=state),
+        client=SimpleNamespace(host="10.0.0.1"),
+        headers={},
+    )
+
+
+async def call_next(request):
+    return SimpleNamespace(headers={})
+
+
+async def send(monkeypatch, windows, request):
+    """Run one request through the limiter as the process owning ``windows``"""
+    monkeypatch.setattr(rate_limiter, "_local_windows", windows)
+    try:
+        await rate_limiter.sliding_window_rate_limiter(request, call_next)
+    except Rejected:
+        return False
+    return True
+
+
+def test_local_budget_stays_under_each_instance_share():
+    for n in (1, 4, 12):
+        assert 0 < rate_limiter._local_budget(n) < settings.RATE_LIMIT / n
+    assert rate_limiter._local_budget(None) == 0
+
+
+def test_update_rejection_closes_window(instances):
+    instances(4)
+    window = rate_limiter._LocalWindow()
+    window.update(0, settings.RATE_LIMIT + 1)
+    assert window.budget == -1
+    assert window.count == settings.RATE_LIMIT + 1
+
+
+def test_update_shrinks_budget_as_limit_nears(instances):
+    instances(4)
+    window = rate_limiter._LocalWindow()
+    assert window.budget == rate_limiter._LOCAL_BUDGET
+
+    window.update(1, 10)
+    assert window.budget == min(rate_limiter._LOCAL_BUDGET, (settings.RATE_LIMIT - 10) // 16)
+
+    # A stale, lower count from a concurrent report never raises the budget again
+    window.update(1, settings.RATE_LIMIT - 5)
+    window.update(1, 10)
+    assert window.count == settings.RATE_LIMIT - 5
+    assert window.budget == 0
+
+
+def test_unset_instances_reports_every_request(instances):
+    instances(None)
+    window = rate_limiter._LocalWindow()
+    window.update(1, 1)
+    assert window.budget == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("n", [None, 1, 4, 12])
+async def test_instances_stay_within_limit(monkeypatch, instances, n):
+    instances(n)
+    script = FakeFixedWindowScript()
+    request = make_request(script)
+    processes = [{} for _ in range(n or 1)]
+
+    admitted = 0
+    for i in range(settings.RATE_LIMIT * 3):
+        admitted += await send(monkeypatch, processes[i % len(processes)], request)
+
+    # Batches still held in-process when the limit is hit may overshoot slightly
+    assert settings.RATE_LIMIT <= admitted <= settings.RATE_LIMIT * 1.05
+    if n:
+        assert script.calls < admitted
+
+
+@pytest.mark.asyncio
+async def test_redis_error_keeps_pending_batch(monkeypatch, instances):
+    instances(4)
+    script = FakeFixedWindowScript()
+    request = make_request(script)
+    windows = {}
+
+    budget = rate_limiter._LOCAL_BUDGET
+    for _ in range(budget):
+        assert await send(monkeypatch, windows, request)
+    assert script.calls == 0
+
+    # The report fails: the request is let through and the batch is kept
+    script.fail = True
+    assert await send(monkeypatch, windows, request)
+    assert script.calls == 1
+    (window,) = windows.values()
+    assert window.pending == budget + 1
+
+    # Counting resumes locally instead of retrying Redis on every request
+    for _ in range(budget):
+        assert await send(monkeypatch, windows, request)
+    assert script.calls == 1
+
+    # The next report carries every request admitted since the window opened
+    script.fail = False
+    assert await send(monkeypatch, windows, request)
+    assert script.calls == 2
+    assert list(script.counts.values()) == [2 * budget + 2]